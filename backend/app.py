@@ -0,0 +1,1012 @@
+#!/usr/bin/env python3
+"""
+AI Onboarding Coach - Flask Backend
+Analyzes screenshots with Gemini Vision and provides step-by-step coaching
+for GCP, Jira and file-conversion onboarding tasks.
+"""
+
+import os
+import io
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import queue
+import threading
+import time
+import typing
+from datetime import datetime
+
+import google.generativeai as genai
+import imagehash
+import numpy as np
+import json_repair
+import orjson
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_cors import CORS
+from PIL import Image
+
+try:
+    # SIMD-accelerated base64 — worthwhile on multi-MB screenshot payloads
+    from pybase64 import b64decode
+except ImportError:
+    from base64 import b64decode
+
+try:
+    # libjpeg-turbo decode: SSE2/AVX2 IDCT, several times faster than Pillow
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo = TurboJPEG()
+except Exception:
+    _turbo = None
+
+try:
+    # libvips decode for PNG screenshots
+    import pyvips
+except ImportError:
+    pyvips = None
+
+load_dotenv()
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson — jsonify gets the fast encoder too"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+CORS(app)
+
+genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+
+class AnalysisSchema(typing.TypedDict):
+    current_page: str
+    elements_visible: list[str]
+    user_action: str
+    matches_expected_step: bool
+    errors_visible: list[str]
+    progress_percent: int
+
+
+class GuidanceSchema(typing.TypedDict):
+    step_status: str
+    message: str
+    specific_issues: list[str]
+    next_actions: list[str]
+    explanation: str
+
+
+# Force valid JSON at decode time instead of begging for it in the prompt
+ANALYSIS_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': AnalysisSchema,
+    'temperature': 0,
+}
+
+GUIDANCE_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': GuidanceSchema,
+    'temperature': 0,
+}
+
+BATCH_ANALYSIS_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': list[AnalysisSchema],
+    'temperature': 0,
+}
+
+# Optional micro-batching: coalesce concurrent analyze calls for the same
+# task into a single multi-image Gemini request, amortizing one RTT over
+# up to 8 screenshots. The 20 ms collection window only pays off under
+# real concurrency, so it's off unless MICRO_BATCH=1.
+MICRO_BATCH = os.getenv('MICRO_BATCH') == '1'
+MICRO_BATCH_WINDOW = 0.02  # seconds
+MICRO_BATCH_MAX = 8
+
+_batch_queue = queue.Queue()
+
+
+def _drain_batch_queue():
+    """Collect up to MICRO_BATCH_MAX items within the batching window"""
+    items = [_batch_queue.get()]
+    deadline = time.monotonic() + MICRO_BATCH_WINDOW
+    while len(items) < MICRO_BATCH_MAX:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(_batch_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
+
+
+def _run_analysis_batch(task_type, group):
+    """Send one Gemini request for a group of screenshots, resolve futures"""
+    try:
+        if len(group) == 1:
+            _, prompt, image_blob, future = group[0]
+            response = vision_models[task_type].generate_content(
+                [prompt, image_blob], generation_config=ANALYSIS_GENERATION_CONFIG
+            )
+            future.set_result(orjson.loads(response.text))
+            return
+
+        parts = [
+            f'Analyze the following {len(group)} screenshots. Return a JSON '
+            f'array with exactly one analysis object per screenshot, in order.'
+        ]
+        for _, prompt, image_blob, _ in group:
+            parts.append(prompt)
+            parts.append(image_blob)
+        response = vision_models[task_type].generate_content(
+            parts, generation_config=BATCH_ANALYSIS_GENERATION_CONFIG
+        )
+        results = orjson.loads(response.text)
+        for (_, _, _, future), analysis in zip(group, results):
+            future.set_result(analysis)
+        for _, _, _, future in group[len(results):]:
+            future.set_exception(RuntimeError('Batched analysis returned too few results'))
+    except Exception as e:
+        for _, _, _, future in group:
+            if not future.done():
+                future.set_exception(e)
+
+
+def _micro_batch_worker():
+    """Background thread: drain the queue, group by task, batch per group.
+
+    A plain thread (not an event-loop coroutine) on purpose: Flask runs
+    each async view in its own short-lived event loop, so only
+    thread-level primitives can coalesce work across requests.
+    """
+    while True:
+        by_task = {}
+        for item in _drain_batch_queue():
+            by_task.setdefault(item[0], []).append(item)
+        for task_type, group in by_task.items():
+            _run_analysis_batch(task_type, group)
+
+
+if MICRO_BATCH:
+    threading.Thread(target=_micro_batch_worker, daemon=True).start()
+
+# Rolling log of recent screenshot analyses (exposed at /api/history).
+# Bounded so a long-running server doesn't leak memory.
+analysis_history = collections.deque(maxlen=1000)
+
+# Semantic cache for screenshot analysis. Onboarding screens barely change
+# between 5-second captures, so near-identical frames skip the Gemini call
+# entirely. Keyed by (task_type, current_step, perceptual hash, mouse tile).
+analysis_cache = TTLCache(maxsize=512, ttl=600)
+
+# TTLCache is not thread-safe, and under threaded gunicorn (and the
+# micro-batch worker) it is touched from concurrent request threads
+analysis_cache_lock = threading.Lock()
+
+# Second-tier semantic cache for coaching: analyses that say the same
+# thing in different words (same page, same errors) share one guidance
+# response, found by cosine similarity over Gemini embeddings
+semantic_cache = collections.deque(maxlen=256)
+SEMANTIC_SIMILARITY_THRESHOLD = 0.92
+EMBEDDING_MODEL = 'models/text-embedding-004'
+
+# Max Hamming distance between 16x16 perceptual hashes still treated as
+# "the same screen" (tolerates cursor movement, spinners, clock ticks)
+PHASH_DISTANCE_THRESHOLD = 4
+
+# Mouse coordinates are bucketed to 64-px tiles so small cursor jitter
+# doesn't produce a new cache key
+MOUSE_TILE_SIZE = 64
+
+# Screenshots are shrunk before hitting Gemini: fewer image tokens, less
+# prefill time, fewer bytes over the wire
+MAX_IMAGE_EDGE = 1024
+ROI_SIZE = 768
+JPEG_QUALITY = 80
+
+
+class Step(typing.NamedTuple):
+    step: int
+    title: str
+    description: str
+    keywords: tuple
+    keywords_lower: frozenset
+
+
+class Checklist(typing.NamedTuple):
+    name: str
+    steps: tuple
+
+
+# Raw checklist definitions — frozen into namedtuples below
+_CHECKLIST_DATA = {
+    'gcp_storage': {
+        'name': 'Create a Cloud Storage Bucket',
+        'steps': [
+            {
+                'step': 1,
+                'title': 'Open the GCP Console',
+                'description': 'Navigate to console.cloud.google.com and make sure you are signed in to the right project.',
+                'keywords': ['Google Cloud', 'Console', 'Dashboard', 'Project']
+            },
+            {
+                'step': 2,
+                'title': 'Navigate to Cloud Storage',
+                'description': 'Open the navigation menu and select Cloud Storage > Buckets.',
+                'keywords': ['Cloud Storage', 'Buckets', 'Storage']
+            },
+            {
+                'step': 3,
+                'title': 'Start bucket creation',
+                'description': 'Click the "Create" button at the top of the Buckets page.',
+                'keywords': ['Create', 'Create bucket', 'Create a bucket']
+            },
+            {
+                'step': 4,
+                'title': 'Name your bucket',
+                'description': 'Enter a globally-unique, lowercase bucket name.',
+                'keywords': ['Name your bucket', 'bucket name', 'globally unique']
+            },
+            {
+                'step': 5,
+                'title': 'Choose a location',
+                'description': 'Pick a region close to your users (e.g. us-central1).',
+                'keywords': ['Location', 'Region', 'Multi-region', 'us-central1']
+            },
+            {
+                'step': 6,
+                'title': 'Choose a storage class',
+                'description': 'Select a default storage class (Standard is fine for onboarding).',
+                'keywords': ['Storage class', 'Standard', 'Nearline', 'Coldline', 'Archive']
+            },
+            {
+                'step': 7,
+                'title': 'Create and verify',
+                'description': 'Click Create and confirm the bucket appears in the Buckets list.',
+                'keywords': ['Bucket details', 'Objects', 'Configuration', 'created']
+            }
+        ]
+    },
+    'gcp_function': {
+        'name': 'Deploy a Cloud Function',
+        'steps': [
+            {
+                'step': 1,
+                'title': 'Open the GCP Console',
+                'description': 'Navigate to console.cloud.google.com and select your project.',
+                'keywords': ['Google Cloud', 'Console', 'Dashboard', 'Project']
+            },
+            {
+                'step': 2,
+                'title': 'Navigate to Cloud Functions',
+                'description': 'Open the navigation menu and select Cloud Functions.',
+                'keywords': ['Cloud Functions', 'Functions']
+            },
+            {
+                'step': 3,
+                'title': 'Start function creation',
+                'description': 'Click "Create function" at the top of the Functions page.',
+                'keywords': ['Create function', 'Create Function']
+            },
+            {
+                'step': 4,
+                'title': 'Configure the trigger',
+                'description': 'Name the function and choose an HTTPS trigger with unauthenticated invocations allowed.',
+                'keywords': ['Trigger', 'HTTPS', 'Allow unauthenticated', 'Function name']
+            },
+            {
+                'step': 5,
+                'title': 'Write the function code',
+                'description': 'In the inline editor, choose a runtime and edit the source.',
+                'keywords': ['Source code', 'Inline editor', 'Runtime', 'Entry point']
+            },
+            {
+                'step': 6,
+                'title': 'Deploy',
+                'description': 'Click Deploy and wait for the green check next to the function.',
+                'keywords': ['Deploy', 'Deploying', 'deployed']
+            },
+            {
+                'step': 7,
+                'title': 'Test the function',
+                'description': 'Open the Testing tab (or the trigger URL) and verify the response.',
+                'keywords': ['Testing', 'Trigger URL', 'Test the function', 'Output']
+            }
+        ]
+    },
+    'jira': {
+        'name': 'Create and Assign a Jira Ticket',
+        'steps': [
+            {
+                'step': 1,
+                'title': 'Open Jira',
+                'description': 'Navigate to your Jira workspace and sign in.',
+                'keywords': ['Jira', 'Your work', 'Projects', 'Dashboard']
+            },
+            {
+                'step': 2,
+                'title': 'Open your project',
+                'description': 'Select the onboarding project from the Projects menu.',
+                'keywords': ['Project', 'Backlog', 'Board', 'Timeline']
+            },
+            {
+                'step': 3,
+                'title': 'Create an issue',
+                'description': 'Click the Create button in the top navigation bar.',
+                'keywords': ['Create', 'Create issue', 'New issue']
+            },
+            {
+                'step': 4,
+                'title': 'Fill in summary and description',
+                'description': 'Give the issue a clear summary and a short description.',
+                'keywords': ['Summary', 'Description', 'Issue type', 'Story', 'Task']
+            },
+            {
+                'step': 5,
+                'title': 'Set the priority',
+                'description': 'Choose an appropriate priority for the issue.',
+                'keywords': ['Priority', 'High', 'Medium', 'Low']
+            },
+            {
+                'step': 6,
+                'title': 'Assign the issue',
+                'description': 'Assign the issue to yourself (or the right teammate).',
+                'keywords': ['Assignee', 'Assign', 'Assign to me']
+            },
+            {
+                'step': 7,
+                'title': 'Move it to In Progress',
+                'description': 'Transition the issue from To Do to In Progress on the board.',
+                'keywords': ['In Progress', 'To Do', 'Done', 'Transition']
+            }
+        ]
+    },
+    'conversion': {
+        'name': 'Convert a File',
+        'steps': [
+            {
+                'step': 1,
+                'title': 'Open the conversion tool',
+                'description': 'Navigate to the file conversion page of the internal tools portal.',
+                'keywords': ['Convert', 'Conversion', 'File converter', 'Tools']
+            },
+            {
+                'step': 2,
+                'title': 'Upload your file',
+                'description': 'Drag and drop the source file or use the file picker.',
+                'keywords': ['Upload', 'Drag and drop', 'Choose file', 'Browse']
+            },
+            {
+                'step': 3,
+                'title': 'Select the output format',
+                'description': 'Pick the target format from the output dropdown.',
+                'keywords': ['Output format', 'Format', 'PDF', 'CSV', 'PNG']
+            },
+            {
+                'step': 4,
+                'title': 'Configure options',
+                'description': 'Adjust quality/compression options if needed (defaults are fine).',
+                'keywords': ['Options', 'Quality', 'Compression', 'Settings']
+            },
+            {
+                'step': 5,
+                'title': 'Start the conversion',
+                'description': 'Click Convert and wait for the progress bar to finish.',
+                'keywords': ['Convert', 'Converting', 'Progress']
+            },
+            {
+                'step': 6,
+                'title': 'Download the result',
+                'description': 'Click Download once the conversion completes.',
+                'keywords': ['Download', 'Completed', 'Ready']
+            },
+            {
+                'step': 7,
+                'title': 'Verify the output',
+                'description': 'Open the downloaded file and check it converted correctly.',
+                'keywords': ['Preview', 'Open', 'Verify', 'Result']
+            }
+        ]
+    }
+}
+
+
+# Freeze the checklists into read-only namedtuples: attribute access beats
+# dict hashing in the per-request formatters, and the lowered keyword sets
+# are computed exactly once
+ONBOARDING_CHECKLISTS = {
+    task: Checklist(
+        name=data['name'],
+        steps=tuple(
+            Step(
+                step=s['step'],
+                title=s['title'],
+                description=s['description'],
+                keywords=tuple(s['keywords']),
+                keywords_lower=frozenset(k.lower() for k in s['keywords'])
+            )
+            for s in data['steps']
+        )
+    )
+    for task, data in _CHECKLIST_DATA.items()
+}
+
+# Serialized once at import — /api/checklist returns these bytes untouched
+CHECKLIST_JSON = {
+    task: orjson.dumps({
+        'success': True,
+        'checklist': {
+            'name': checklist.name,
+            'steps': [
+                {'step': s.step, 'title': s.title, 'description': s.description, 'keywords': list(s.keywords)}
+                for s in checklist.steps
+            ]
+        }
+    })
+    for task, checklist in ONBOARDING_CHECKLISTS.items()
+}
+
+# Strong ETags over the pre-serialized bytes — clients polling the static
+# checklists get a zero-body 304 instead of a re-send
+CHECKLIST_ETAG = {
+    task: hashlib.md5(payload).hexdigest()
+    for task, payload in CHECKLIST_JSON.items()
+}
+
+
+def format_checklist(task_type):
+    """Render a checklist as numbered lines for a system instruction"""
+    checklist = ONBOARDING_CHECKLISTS[task_type]
+    lines = [f"Task: {checklist.name}"]
+    for step in checklist.steps:
+        lines.append(f"{step.step}. {step.title} — {step.description}")
+    return '\n'.join(lines)
+
+
+# The coach persona and checklist never change per request, so they live in
+# system_instruction on shared per-task model instances — only the delta
+# (current step, screen analysis) is sent each call. Explicit
+# genai.caching.CachedContent has a ~32k-token minimum that these prompts
+# don't come close to, so system_instruction is the right-sized mechanism.
+vision_models = {
+    task: genai.GenerativeModel(
+        'gemini-2.0-flash',
+        system_instruction=f"""You are an AI onboarding coach watching a user work through this task:
+
+{format_checklist(task)}
+
+For each screenshot: name the page/screen shown, list notable UI elements
+and text, describe what the user appears to be doing, say whether the
+screen matches the expected step, list any visible error messages, and
+estimate progress through the step as a percentage."""
+    )
+    for task in ONBOARDING_CHECKLISTS
+}
+
+chat_models = {
+    task: genai.GenerativeModel(
+        'gemini-2.5-pro',
+        system_instruction=f"""You are a friendly onboarding coach helping a user through this task:
+
+{format_checklist(task)}
+
+Given the expected step and an analysis of the user's screen, set
+step_status to one of "correct", "wrong_step", "has_errors" or
+"incomplete". Give a one-sentence headline message, list any concrete
+problems you can see, list the next 1-3 concrete things to click or type,
+and briefly explain why this step matters."""
+    )
+    for task in ONBOARDING_CHECKLISTS
+}
+
+
+def detect_step(task_type, screen_texts):
+    """Guess which checklist step a screen belongs to from its visible text.
+
+    Lowercases the screen text once, then counts keyword hits per step.
+    Returns the best-matching step number, or None if nothing matches.
+    """
+    checklist = ONBOARDING_CHECKLISTS.get(task_type)
+    if not checklist or not screen_texts:
+        return None
+
+    haystack = ' '.join(str(t) for t in screen_texts).lower()
+    best_step = None
+    best_hits = 0
+    for step in checklist.steps:
+        hits = sum(1 for keyword in step.keywords_lower if keyword in haystack)
+        if hits > best_hits:
+            best_hits = hits
+            best_step = step.step
+    return best_step
+
+
+def decode_image(image_data, mime_hint=''):
+    """Decode screenshot bytes into a PIL image.
+
+    Routes JPEG through libjpeg-turbo and PNG through libvips when those
+    are installed, falling back to Pillow for anything else (or when the
+    fast path chokes on an odd file).
+    """
+    if _turbo is not None and 'jpeg' in mime_hint:
+        try:
+            return Image.fromarray(_turbo.decode(image_data, pixel_format=TJPF_RGB))
+        except Exception:
+            pass
+    if pyvips is not None and 'png' in mime_hint:
+        try:
+            return Image.fromarray(pyvips.Image.new_from_buffer(image_data, '').numpy())
+        except Exception:
+            pass
+    return Image.open(io.BytesIO(image_data))
+
+
+def prepare_image_for_gemini(image, mouse_position=None):
+    """Shrink a screenshot to what Gemini actually needs to see.
+
+    Crops a 768x768 window around the cursor when we know where it is (the
+    prompt's attention is concentrated there anyway), caps the long edge at
+    1024 px, and re-encodes as JPEG q=80. Returns an inline-data blob dict
+    ready to pass to generate_content.
+    """
+    if mouse_position:
+        try:
+            x = int(mouse_position.get('x', 0))
+            y = int(mouse_position.get('y', 0))
+            half = ROI_SIZE // 2
+            left = max(0, min(x - half, image.width - ROI_SIZE))
+            top = max(0, min(y - half, image.height - ROI_SIZE))
+            if image.width > ROI_SIZE and image.height > ROI_SIZE:
+                image = image.crop((left, top, left + ROI_SIZE, top + ROI_SIZE))
+        except (TypeError, ValueError):
+            pass
+
+    image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.Resampling.LANCZOS)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=JPEG_QUALITY)
+    return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
+
+
+def _extract_json(text):
+    """Pull the first JSON object out of an LLM response.
+
+    Slices from the first '{' to the last '}' (no markdown-fence splitting),
+    decodes with orjson, and falls back to json_repair for the almost-JSON
+    the model sometimes produces. A stream truncated before the closing
+    brace still goes through json_repair rather than being dropped.
+    Returns None if no object can be salvaged.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    end = text.rfind('}')
+    span = text[start:] if end <= start else text[start:end + 1]
+    try:
+        return orjson.loads(span)
+    except orjson.JSONDecodeError:
+        repaired = json_repair.repair_json(span, return_objects=True)
+        return repaired if isinstance(repaired, dict) else None
+
+
+def get_step(task_type, current_step):
+    """Return the checklist step dict for a task, or None if out of range"""
+    checklist = ONBOARDING_CHECKLISTS.get(task_type)
+    if not checklist:
+        return None
+    if 1 <= current_step <= len(checklist.steps):
+        return checklist.steps[current_step - 1]
+    return None
+
+
+def bucket_mouse(mouse_position):
+    """Snap a mouse position to a 64-px tile so jitter shares a cache key"""
+    if not mouse_position:
+        return None
+    try:
+        x = int(mouse_position.get('x', 0))
+        y = int(mouse_position.get('y', 0))
+    except (TypeError, ValueError):
+        return None
+    return (x // MOUSE_TILE_SIZE, y // MOUSE_TILE_SIZE)
+
+
+def cache_lookup(task_type, current_step, phash, mouse_tile):
+    """
+    Look up a cached analysis for a perceptually-similar screenshot.
+
+    Tries an exact key first, then falls back to a Hamming-distance scan
+    over the (at most 512) cached keys — near-duplicate frames differ by
+    a few bits of phash, not a whole new key.
+    """
+    key = (task_type, current_step, str(phash), mouse_tile)
+    with analysis_cache_lock:
+        hit = analysis_cache.get(key)
+        if hit is not None:
+            return hit
+        entries = list(analysis_cache.items())
+
+    for (cached_task, cached_step, cached_hash, cached_tile), cached_analysis in entries:
+        if cached_task != task_type or cached_step != current_step or cached_tile != mouse_tile:
+            continue
+        if phash - imagehash.hex_to_hash(cached_hash) <= PHASH_DISTANCE_THRESHOLD:
+            return cached_analysis
+    return None
+
+
+async def run_analysis(screenshot, task_type, current_step, mouse_position):
+    """Run the (cached) Gemini Vision analysis. Returns (analysis, cached)."""
+    # Skip past the data-URL header without split()'s extra copies;
+    # find() returns -1 for bare base64, so idx=0 degrades gracefully
+    idx = screenshot.find(',') + 1
+    image_data = b64decode(screenshot[idx:], validate=False)
+    # Image decode is CPU-bound — keep it off the event loop. The data-URL
+    # header tells decode_image which fast path applies.
+    image = await asyncio.to_thread(decode_image, image_data, screenshot[:idx].lower())
+
+    # Check the semantic cache before spending a Gemini call
+    phash = imagehash.phash(image, hash_size=16)
+    mouse_tile = bucket_mouse(mouse_position)
+    cached = cache_lookup(task_type, current_step, phash, mouse_tile)
+    if cached is not None:
+        return cached, True
+
+    # The persona + checklist live in the model's system_instruction;
+    # only the per-request delta goes over the wire
+    prompt = analysis_prompt(task_type, current_step)
+
+    image_blob = await asyncio.to_thread(prepare_image_for_gemini, image, mouse_position)
+    if MICRO_BATCH:
+        future = concurrent.futures.Future()
+        _batch_queue.put((task_type, prompt, image_blob, future))
+        analysis = await asyncio.wrap_future(future)
+    else:
+        response = await vision_models[task_type].generate_content_async(
+            [prompt, image_blob], generation_config=ANALYSIS_GENERATION_CONFIG
+        )
+        # response_schema guarantees a valid JSON object
+        analysis = orjson.loads(response.text)
+    analysis['detected_step'] = detect_step(task_type, analysis.get('elements_visible', []))
+
+    with analysis_cache_lock:
+        analysis_cache[(task_type, current_step, str(phash), mouse_tile)] = analysis
+    analysis_history.append({
+        'timestamp': datetime.now().isoformat(),
+        'task_type': task_type,
+        'current_step': current_step,
+        'analysis': analysis
+    })
+    return analysis, False
+
+
+@app.route('/api/screenshot/analyze', methods=['POST'])
+async def analyze_screenshot():
+    """Analyze a screenshot with Gemini Vision against the expected step"""
+    data = request.json
+    screenshot = data.get('screenshot', '')
+    task_type = data.get('task_type', 'gcp_storage')
+    current_step = int(data.get('current_step', 1))
+    mouse_position = data.get('mouse_position')
+
+    step = get_step(task_type, current_step)
+    if step is None:
+        return jsonify({'success': False, 'error': f'Unknown task/step: {task_type}/{current_step}'}), 400
+
+    try:
+        analysis, cached = await run_analysis(screenshot, task_type, current_step, mouse_position)
+        return jsonify({'success': True, 'analysis': analysis, 'cached': cached})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@functools.lru_cache(maxsize=64)
+def analysis_prompt(task_type, current_step):
+    """Static per-(task, step) analyze prompt — only ~28 combos exist"""
+    step = get_step(task_type, current_step)
+    return f'The user should currently be on step {current_step}: "{step.title}". Analyze this screenshot.'
+
+
+@functools.lru_cache(maxsize=64)
+def coaching_prompt_prefix(task_type, current_step):
+    """Static head of the coaching prompt, built once per (task, step)"""
+    step = get_step(task_type, current_step)
+    return (
+        f'The user should be on step {current_step}: "{step.title}".\n\n'
+        'Here is what is currently on their screen:\n'
+    )
+
+
+def build_coaching_prompt(analysis, task_type, current_step):
+    """Cached static prefix + the per-request screen analysis"""
+    return coaching_prompt_prefix(task_type, current_step) + json.dumps(analysis, indent=2)
+
+
+def fallback_guidance(step, guidance_text):
+    """Last-resort guidance when the model response can't be parsed"""
+    return {
+        'step_status': 'incomplete',
+        'message': 'Keep going — following the checklist step.',
+        'specific_issues': [],
+        'next_actions': [step.description],
+        'explanation': '',
+        'raw_response': guidance_text
+    }
+
+
+# Short-circuit rate telemetry: how often coaching resolved without Gemini
+coaching_stats = collections.Counter()
+
+
+def fast_classify(analysis, step):
+    """Rule-based guidance for trivially decidable screens.
+
+    Visible errors, a screen that clearly belongs to a different step, or
+    a completed step don't need Gemini 2.5-pro to classify. Returns a full
+    guidance dict for those cases, or None when the screen is ambiguous.
+    """
+    errors = [str(e) for e in analysis.get('errors_visible', []) if e]
+    if errors:
+        return {
+            'step_status': 'has_errors',
+            'message': 'There are errors on screen to fix before moving on.',
+            'specific_issues': errors,
+            'next_actions': ['Resolve the errors shown on screen', step.description],
+            'explanation': f'Errors block progress on "{step.title}".'
+        }
+
+    haystack = ' '.join(
+        [str(analysis.get('current_page', ''))] + [str(e) for e in analysis.get('elements_visible', [])]
+    ).lower()
+    on_expected_screen = any(k in haystack for k in step.keywords_lower)
+    detected = analysis.get('detected_step')
+    if not on_expected_screen and detected is not None and detected != step.step:
+        return {
+            'step_status': 'wrong_step',
+            'message': f'This looks like step {detected}, not step {step.step} ("{step.title}").',
+            'specific_issues': [f'The current screen does not match "{step.title}".'],
+            'next_actions': [step.description],
+            'explanation': 'Following the checklist order keeps later steps from failing.'
+        }
+
+    # progress_percent is client-supplied on the coaching endpoint, so it
+    # may be missing or non-numeric
+    try:
+        progress = int(analysis.get('progress_percent') or 0)
+    except (TypeError, ValueError):
+        progress = 0
+    if analysis.get('matches_expected_step') and progress >= 100:
+        return {
+            'step_status': 'correct',
+            'message': f'Step {step.step} ("{step.title}") looks complete — nice work!',
+            'specific_issues': [],
+            'next_actions': ['Move on to the next step'],
+            'explanation': step.description
+        }
+
+    return None
+
+
+def analysis_fingerprint(analysis):
+    """Canonical text form of the fields that determine the right guidance"""
+    return '|'.join([
+        str(analysis.get('current_page', '')),
+        ' '.join(str(e) for e in analysis.get('elements_visible', [])),
+        str(analysis.get('user_action', '')),
+        ' '.join(str(e) for e in analysis.get('errors_visible', []))
+    ])
+
+
+def embed_fingerprint(fingerprint):
+    """Embed an analysis fingerprint; returns a unit vector, or None on failure"""
+    try:
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=fingerprint)
+        vec = np.asarray(result['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+    except Exception:
+        return None
+
+
+def semantic_cache_lookup(task_type, current_step, vec):
+    """Linear cosine scan over the (small) cache — ~µs vs a 2.5-pro call"""
+    if vec is None:
+        return None
+    best = None
+    best_sim = SEMANTIC_SIMILARITY_THRESHOLD
+    # Snapshot before scanning — concurrent requests append to the shared
+    # deque, and iterating it live raises RuntimeError under threaded load
+    for cached_task, cached_step, cached_vec, cached_guidance in list(semantic_cache):
+        if cached_task != task_type or cached_step != current_step:
+            continue
+        sim = float(np.dot(vec, cached_vec))
+        if sim >= best_sim:
+            best_sim = sim
+            best = cached_guidance
+    return best
+
+
+async def run_guidance(step, analysis, task_type, current_step):
+    """Run the coaching model once (non-streaming) and return the guidance"""
+    fast = fast_classify(analysis, step)
+    if fast is not None:
+        coaching_stats['fast_path'] += 1
+        return fast
+    coaching_stats['llm_path'] += 1
+
+    vec = await asyncio.to_thread(embed_fingerprint, analysis_fingerprint(analysis))
+    cached = semantic_cache_lookup(task_type, current_step, vec)
+    if cached is not None:
+        return cached
+
+    coaching_prompt = build_coaching_prompt(analysis, task_type, current_step)
+    response = await chat_models[task_type].generate_content_async(
+        coaching_prompt, generation_config=GUIDANCE_GENERATION_CONFIG
+    )
+    guidance = _extract_json(response.text)
+    if guidance is None:
+        guidance = fallback_guidance(step, response.text)
+    elif vec is not None:
+        semantic_cache.append((task_type, current_step, vec, guidance))
+    return guidance
+
+
+@app.route('/api/screenshot/coach', methods=['POST'])
+async def coach_screenshot():
+    """Fused analyze + coach: one HTTP hop from the client, and the coaching
+    call launches the moment the vision analysis lands instead of waiting
+    for another client roundtrip."""
+    data = request.json
+    screenshot = data.get('screenshot', '')
+    task_type = data.get('task_type', 'gcp_storage')
+    current_step = int(data.get('current_step', 1))
+    mouse_position = data.get('mouse_position')
+
+    step = get_step(task_type, current_step)
+    if step is None:
+        return jsonify({'success': False, 'error': f'Unknown task/step: {task_type}/{current_step}'}), 400
+
+    try:
+        analysis, cached = await run_analysis(screenshot, task_type, current_step, mouse_position)
+        guidance = await run_guidance(step, analysis, task_type, current_step)
+        return jsonify({'success': True, 'analysis': analysis, 'guidance': guidance, 'cached': cached})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/coaching/guidance', methods=['POST'])
+def get_coaching_guidance():
+    """Stream step-by-step coaching guidance as NDJSON while Gemini generates.
+
+    Each line is a JSON object: {"delta": ...} per token chunk, then a final
+    {"done": true, "guidance": {...}} line once the full response has been
+    parsed. Clients that only want the final answer can read the last line.
+    (Sync on purpose: Flask streams from a plain generator, and the blocking
+    stream=True iterator inside it doesn't hold up other requests.)
+    """
+    data = request.json
+    # Client-supplied, not schema-constrained: null or a non-object would
+    # otherwise blow up in fast_classify before the endpoint's JSON error
+    # handling gets a chance
+    analysis = data.get('analysis') or {}
+    if not isinstance(analysis, dict):
+        return jsonify({'success': False, 'error': 'analysis must be a JSON object'}), 400
+    task_type = data.get('task_type', 'gcp_storage')
+    current_step = int(data.get('current_step', 1))
+
+    step = get_step(task_type, current_step)
+    if step is None:
+        return jsonify({'success': False, 'error': f'Unknown task/step: {task_type}/{current_step}'}), 400
+
+    # Trivially decidable screens resolve from local rules with no model
+    # call at all, streamed as a single final line
+    fast = fast_classify(analysis, step)
+    if fast is not None:
+        coaching_stats['fast_path'] += 1
+        line = json.dumps({'done': True, 'success': True, 'guidance': fast, 'cached': False}) + '\n'
+        return Response(line, mimetype='application/x-ndjson')
+    coaching_stats['llm_path'] += 1
+
+    # Semantically-equivalent analyses reuse a prior guidance response;
+    # a hit streams as a single final line with no Gemini call at all
+    vec = embed_fingerprint(analysis_fingerprint(analysis))
+    cached = semantic_cache_lookup(task_type, current_step, vec)
+    if cached is not None:
+        line = json.dumps({'done': True, 'success': True, 'guidance': cached, 'cached': True}) + '\n'
+        return Response(line, mimetype='application/x-ndjson')
+
+    coaching_prompt = build_coaching_prompt(analysis, task_type, current_step)
+
+    def generate():
+        guidance_text = ''
+        try:
+            response = chat_models[task_type].generate_content(
+                coaching_prompt, stream=True, generation_config=GUIDANCE_GENERATION_CONFIG
+            )
+            for chunk in response:
+                if not chunk.text:
+                    continue
+                guidance_text += chunk.text
+                yield json.dumps({'delta': chunk.text}) + '\n'
+        except Exception as e:
+            yield json.dumps({'done': True, 'success': False, 'error': str(e)}) + '\n'
+            return
+
+        # Schema-constrained output is plain JSON; _extract_json only has to
+        # rescue streams that were cut off mid-generation
+        try:
+            guidance = orjson.loads(guidance_text)
+        except orjson.JSONDecodeError:
+            guidance = _extract_json(guidance_text)
+        if guidance is None:
+            guidance = fallback_guidance(step, guidance_text)
+        elif vec is not None:
+            semantic_cache.append((task_type, current_step, vec, guidance))
+
+        yield json.dumps({'done': True, 'success': True, 'guidance': guidance}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/checklist/<task_type>')
+def get_checklist(task_type):
+    """Return the full checklist for a task type"""
+    payload = CHECKLIST_JSON.get(task_type)
+    if payload is None:
+        return jsonify({'success': False, 'error': f'Unknown task type: {task_type}'}), 404
+
+    etag = CHECKLIST_ETAG[task_type]
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304, {'ETag': etag}
+    return Response(
+        payload,
+        mimetype='application/json',
+        headers={'ETag': etag, 'Cache-Control': 'public, max-age=3600'}
+    )
+
+
+@app.route('/api/history')
+def get_history():
+    """Return a page of the rolling analysis history (?offset=&limit=)"""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(200, max(1, request.args.get('limit', 50, type=int)))
+    page = list(itertools.islice(analysis_history, offset, offset + limit))
+    return jsonify({
+        'success': True,
+        'total': len(analysis_history),
+        'offset': offset,
+        'limit': limit,
+        'history': page
+    })
+
+
+@app.route('/health')
+def health():
+    """Health check endpoint"""
+    return {
+        'status': 'ok',
+        'tasks': list(ONBOARDING_CHECKLISTS.keys()),
+        'coaching_stats': dict(coaching_stats)
+    }
+
+
+if __name__ == '__main__':
+    # Dev server only — single-threaded, serializes every Gemini call.
+    # In production run under gunicorn with threaded workers:
+    #   gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 app:app
+    print("🤖 AI Onboarding Coach Backend")
+    print(f"   Tasks: {', '.join(ONBOARDING_CHECKLISTS.keys())}")
+    print("   Server: http://localhost:5000")
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -342,7 +342,49 @@
       })
     });
 
-    return await response.json();
+    // Backend streams NDJSON: {"delta": ...} lines, then a final
+    // {"done": true, ...} line with the parsed guidance object
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let final = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let newlineIndex;
+      while ((newlineIndex = buffer.indexOf('\n')) !== -1) {
+        const line = buffer.slice(0, newlineIndex).trim();
+        buffer = buffer.slice(newlineIndex + 1);
+        if (!line) continue;
+        try {
+          const event = JSON.parse(line);
+          if (event.done) {
+            final = event;
+          }
+        } catch (e) {
+          // Partial/garbled line — ignore and keep reading
+        }
+      }
+    }
+
+    // A final line without a trailing newline (e.g. a non-streamed error
+    // body from the same endpoint) ends up here rather than in the loop
+    const leftover = buffer.trim();
+    if (leftover) {
+      try {
+        const event = JSON.parse(leftover);
+        if (event.done || final === null) {
+          final = event;
+        }
+      } catch (e) {
+        // Truncated trailing line — nothing usable
+      }
+    }
+
+    return final || { success: false, error: 'Stream ended without a final guidance line' };
   }
 
   /**
@@ -6,7 +6,7 @@ Strips security headers that prevent iframe embedding
 
 from flask import Flask, request, Response
 from flask_cors import CORS
-import requests
+import httpx
 
 app = Flask(__name__)
 CORS(app)
@@ -14,6 +14,34 @@ CORS(app)
 # Target URL
 GCP_CONSOLE_BASE = "https://console.cloud.google.com"
 
+# Shared pooled client: keep-alive + HTTP/2 amortize the TLS handshake
+# across the dozens of sub-resource requests an iframed SPA makes
+CLIENT = httpx.Client(
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+)
+
+# Hoisted out of the hot path: header filters and CORS headers are the
+# same for every proxied request
+REQUEST_EXCLUDED_HEADERS = frozenset({'host', 'connection'})
+
+RESPONSE_EXCLUDED_HEADERS = frozenset({
+    'content-encoding',
+    'content-length',
+    'transfer-encoding',
+    'connection',
+    'x-frame-options',  # This is what blocks iframes
+    'content-security-policy',  # May also block iframes
+    'x-content-security-policy'
+})
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS, PATCH',
+    'Access-Control-Allow-Headers': '*'
+}
+
 @app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
 def proxy(path):
@@ -22,9 +50,7 @@ def proxy(path):
     # Handle OPTIONS preflight requests
     if request.method == 'OPTIONS':
         response = Response()
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-        response.headers['Access-Control-Allow-Headers'] = '*'
+        response.headers.extend(CORS_HEADERS)
         return response
 
     # Build target URL
@@ -35,48 +61,50 @@ def proxy(path):
         url += f"?{request.query_string.decode()}"
 
     # Prepare headers (copy from original request, remove host)
-    headers = {key: value for key, value in request.headers if key.lower() not in ['host', 'connection']}
+    headers = {key: value for key, value in request.headers if key.lower() not in REQUEST_EXCLUDED_HEADERS}
 
     try:
-        # Forward the request
-        resp = requests.request(
+        # Forward the request over the pooled connection, streaming the
+        # body back instead of buffering it (GCP JS bundles run to many MB).
+        # Built as a bare httpx.Request so the shared client's cookie jar is
+        # never merged in — each browser's own Cookie header (already in
+        # `headers`) is the only cookie state that crosses the proxy,
+        # otherwise one client's session cookies would bleed into another's
+        # requests.
+        upstream = httpx.Request(
             method=request.method,
             url=url,
             headers=headers,
-            data=request.data,
-            cookies=request.cookies,
-            allow_redirects=True,
-            verify=True
+            content=request.get_data()
         )
+        resp = CLIENT.send(upstream, stream=True, follow_redirects=True)
 
         # Prepare response headers, removing frame-blocking headers
-        excluded_headers = [
-            'content-encoding',
-            'content-length',
-            'transfer-encoding',
-            'connection',
-            'x-frame-options',  # This is what blocks iframes
-            'content-security-policy',  # May also block iframes
-            'x-content-security-policy'
-        ]
-
         response_headers = {
             key: value for key, value in resp.headers.items()
-            if key.lower() not in excluded_headers
+            if key.lower() not in RESPONSE_EXCLUDED_HEADERS
         }
 
         # Add CORS headers
-        response_headers['Access-Control-Allow-Origin'] = '*'
-        response_headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-        response_headers['Access-Control-Allow-Headers'] = '*'
+        response_headers.update(CORS_HEADERS)
         response_headers['Access-Control-Allow-Credentials'] = 'true'
 
-        # Create response
-        response = Response(resp.content, resp.status_code, response_headers.items())
+        # Relay bytes as they arrive; close the upstream response when done
+        def stream_body():
+            try:
+                yield from resp.iter_bytes(chunk_size=65536)
+            finally:
+                resp.close()
+                # httpx still extracts Set-Cookie into the shared jar;
+                # empty it so nothing accumulates across clients
+                CLIENT.cookies.clear()
+
+        response = Response(stream_body(), resp.status_code, response_headers.items())
 
-        # Set cookies from the proxied response
-        for cookie in resp.cookies:
-            response.set_cookie(cookie.name, cookie.value, domain='localhost')
+        # Set cookies from the proxied response (httpx.Cookies iterates as
+        # names, so go through items() for name/value pairs)
+        for name, value in resp.cookies.items():
+            response.set_cookie(name, value, domain='localhost')
 
         return response
 
@@ -89,8 +117,12 @@ def health():
     return {'status': 'ok', 'proxy_target': GCP_CONSOLE_BASE}
 
 if __name__ == '__main__':
+    # Dev server only. The proxy is pure I/O — in production run it under
+    # gevent so one worker handles thousands of in-flight connections:
+    #   gunicorn -k gevent -w 4 --worker-connections 1000 -b 0.0.0.0:8082 proxy:app
+    import os
     print("🔄 GCP Console Proxy Server")
     print(f"   Proxying: {GCP_CONSOLE_BASE}")
     print("   Server: http://localhost:8082")
     print("   Use this URL in your iframe instead of the direct GCP URL")
-    app.run(host='0.0.0.0', port=8082, debug=True)
+    app.run(host='0.0.0.0', port=8082, debug=os.getenv('FLASK_DEBUG') == '1')